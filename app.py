@@ -1,14 +1,20 @@
 import argparse
+import functools
 import os
-import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
+from typing import NamedTuple
 
+import cv2
 import gradio as gr
 import huggingface_hub
 import numpy as np
 import onnxruntime as rt
 import pandas as pd
-from PIL import Image
+from PIL import Image, UnidentifiedImageError
 
 TITLE = "WaifuDiffusion Tagger"
 DESCRIPTION = """
@@ -19,6 +25,20 @@ Example image by [ほし☆☆☆](https://www.pixiv.net/en/users/43565085)
 
 HF_TOKEN = os.environ.get("HF_TOKEN", "")
 
+# Execution providers to try, in order of preference, with their options
+SESSION_PROVIDERS = [
+    ("OpenVINOExecutionProvider", {"device_type": "CPU_FP32"}),
+    ("DmlExecutionProvider", {"device_id": 0}),
+    ("CUDAExecutionProvider", {}),
+    ("CPUExecutionProvider", {}),
+]
+
+# Directory next to the downloaded model where TensorRT engines are cached
+TRT_ENGINE_CACHE_DIRNAME = "trt_engines"
+
+# Number of loaded models kept in memory for quick switching between repos
+SESSION_CACHE_SIZE = 2
+
 # Dataset v3 series of models:
 SWINV2_MODEL_DSV3_REPO = "SmilingWolf/wd-swinv2-tagger-v3"
 CONV_MODEL_DSV3_REPO = "SmilingWolf/wd-convnext-tagger-v3"
@@ -41,6 +61,17 @@ SWINV2_MODEL_IS_DSV1_REPO = "deepghs/idolsankaku-swinv2-tagger-v1"
 MODEL_FILENAME = "model.onnx"
 LABEL_FILENAME = "selected_tags.csv"
 
+# INT8 model written by quantize.py next to the downloaded model.onnx
+QUANTIZED_MODEL_FILENAME = "model_int8.onnx"
+
+# Number of images stacked into a single model run in batch mode
+BATCH_SIZE = 8
+
+# Worker threads and in-flight images for batch-mode preprocessing; a full
+# batch is prepared ahead while the current one runs through the model
+PREFETCH_WORKERS = 2
+PREFETCH_DEPTH = BATCH_SIZE
+
 # https://github.com/toriato/stable-diffusion-webui-wd14-tagger/blob/a9eacb1eff904552d3012babfa28b57e1d3e295c/tagger/ui.py#L368
 kaomojis = [
     "0_0",
@@ -63,6 +94,10 @@ kaomojis = [
     "|_|",
     "||_||",
 ]
+KAOMOJIS = frozenset(kaomojis)
+
+# Escapes parentheses in the output string so prompts don't treat them as weights
+PAREN_ESCAPE = str.maketrans({"(": "\\(", ")": "\\)"})
 
 
 def parse_args() -> argparse.Namespace:
@@ -70,22 +105,102 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--score-slider-step", type=float, default=0.05)
     parser.add_argument("--score-general-threshold", type=float, default=0.35)
     parser.add_argument("--score-character-threshold", type=float, default=0.85)
+    parser.add_argument(
+        "--tensorrt",
+        action="store_true",
+        help="Run models through cached FP16 TensorRT engines (requires TensorRT)",
+    )
     return parser.parse_args()
 
 
-def load_labels(dataframe) -> list[str]:
+def load_labels(dataframe) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     name_series = dataframe["name"]
-    name_series = name_series.map(
-        lambda x: x.replace("_", " ") if x not in kaomojis else x
+    name_series = name_series.str.replace("_", " ", regex=False).where(
+        ~name_series.isin(KAOMOJIS), name_series
     )
-    tag_names = name_series.tolist()
+    tag_names = name_series.to_numpy(dtype=object)
 
-    rating_indexes = list(np.where(dataframe["category"] == 9)[0])
-    general_indexes = list(np.where(dataframe["category"] == 0)[0])
-    character_indexes = list(np.where(dataframe["category"] == 4)[0])
+    rating_indexes = np.where(dataframe["category"] == 9)[0]
+    general_indexes = np.where(dataframe["category"] == 0)[0]
+    character_indexes = np.where(dataframe["category"] == 4)[0]
     return tag_names, rating_indexes, general_indexes, character_indexes
 
 
+def quantized_model_path(model_path):
+    return Path(model_path).with_name(QUANTIZED_MODEL_FILENAME)
+
+
+def read_varint(f):
+    result = shift = 0
+    while True:
+        byte = f.read(1)[0]
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result
+        shift += 7
+
+
+def iter_proto_fields(f, end):
+    # Walk the protobuf fields between the current offset and end, yielding
+    # (field_number, wire_type, value). For length-delimited fields value is
+    # the payload length, f is left at the payload start, and the payload
+    # is skipped with a seek once the caller moves on.
+    while f.tell() < end:
+        key = read_varint(f)
+        field_number, wire_type = key >> 3, key & 0x7
+        if wire_type == 0:
+            yield field_number, wire_type, read_varint(f)
+        elif wire_type == 2:
+            length = read_varint(f)
+            start = f.tell()
+            yield field_number, wire_type, length
+            f.seek(start + length)
+        elif wire_type in (1, 5):
+            f.seek(8 if wire_type == 1 else 4, os.SEEK_CUR)
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+
+
+def find_proto_field(f, end, number):
+    # Leave f at the payload of the first length-delimited field `number`
+    # and return the payload's end offset
+    for field_number, wire_type, length in iter_proto_fields(f, end):
+        if field_number == number and wire_type == 2:
+            return f.tell() + length
+    raise ValueError(f"Protobuf field {number} not found")
+
+
+def model_input_info(model_path):
+    # Read the first graph input's name and size straight from the ONNX
+    # protobuf (ModelProto.graph -> GraphProto.input -> ValueInfoProto),
+    # seeking past the weights instead of loading them into a session
+    with open(model_path, "rb") as f:
+        end = find_proto_field(f, os.fstat(f.fileno()).st_size, 7)
+        end = find_proto_field(f, end, 11)
+
+        input_name = None
+        dims = []
+        for field_number, _, length in iter_proto_fields(f, end):
+            if field_number == 1:
+                input_name = f.read(length).decode("utf-8")
+            elif field_number == 2:
+                # TypeProto.tensor_type -> TypeProto.Tensor.shape
+                type_end = f.tell() + length
+                tensor_end = find_proto_field(f, type_end, 1)
+                shape_end = find_proto_field(f, tensor_end, 2)
+                for _, _, dim_length in iter_proto_fields(f, shape_end):
+                    # TensorShapeProto.Dimension: dim_value (1) or dim_param (2)
+                    dim_value = None
+                    dim_end = f.tell() + dim_length
+                    for dim_field, wire_type, value in iter_proto_fields(f, dim_end):
+                        if dim_field == 1 and wire_type == 0:
+                            dim_value = value
+                    dims.append(dim_value)
+
+    _, height, width, _ = dims
+    return input_name, height, width
+
+
 def mcut_threshold(probs):
     """
     Maximum Cut Thresholding (MCut)
@@ -93,17 +208,37 @@ def mcut_threshold(probs):
      for Multi-label Classification. In 11th International Symposium, IDA 2012
      (pp. 172-183).
     """
-    sorted_probs = probs[probs.argsort()[::-1]]
-    difs = sorted_probs[:-1] - sorted_probs[1:]
-    t = difs.argmax()
+    sorted_probs = np.sort(probs)
+    difs = np.diff(sorted_probs)
+    # Sorted ascending, so take the last largest gap to match a descending scan
+    t = len(difs) - 1 - difs[::-1].argmax()
     thresh = (sorted_probs[t] + sorted_probs[t + 1]) / 2
     return thresh
 
 
+class LoadedModel(NamedTuple):
+    # Everything needed to tag with one model. load_model hands out a whole
+    # snapshot, so a concurrent switch to another repo (the single-image and
+    # batch tabs are separate Gradio events) can't mix state from two models.
+    model: rt.InferenceSession
+    input_name: str
+    output_name: str
+    input_buffer: np.ndarray
+    input_ortvalue: rt.OrtValue
+    io_binding: rt.IOBinding
+    target_size: int
+    tag_names: np.ndarray
+    rating_indexes: np.ndarray
+    general_indexes: np.ndarray
+    character_indexes: np.ndarray
+
+
 class Predictor:
-    def __init__(self):
-        self.model_target_size = None
-        self.last_loaded_repo = None
+    def __init__(self, use_tensorrt=False):
+        self.use_tensorrt = use_tensorrt
+        self.label_cache = {}
+        self.session_cache = {}
+        self.load_lock = threading.Lock()
 
     def download_model(self, model_repo):
         csv_path = huggingface_hub.hf_hub_download(
@@ -118,57 +253,170 @@ class Predictor:
         )
         return csv_path, model_path
 
+    def session_options(self, providers):
+        sess_options = rt.SessionOptions()
+        sess_options.graph_optimization_level = (
+            rt.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        # Roughly one thread per physical core, leaving room for NumPy/OpenCV
+        sess_options.intra_op_num_threads = max(1, (os.cpu_count() or 1) // 2)
+        sess_options.inter_op_num_threads = 1
+        # DirectML doesn't support memory pattern optimizations
+        if any(name == "DmlExecutionProvider" for name, _ in providers):
+            sess_options.enable_mem_pattern = False
+        return sess_options
+
+    def session_providers(self, model_path):
+        available = rt.get_available_providers()
+        providers = [
+            (name, options)
+            for name, options in SESSION_PROVIDERS
+            if name in available
+        ]
+
+        # With --tensorrt, build an FP16 TensorRT engine on first load and cache
+        # it next to the model so later loads skip the build. This is opt-in
+        # because onnxruntime-gpu lists the provider even without TensorRT
+        # installed. The profile covers batch sizes 1..BATCH_SIZE, so neither
+        # single images nor a short final batch trigger an engine rebuild
+        # inside a request.
+        if self.use_tensorrt and "TensorrtExecutionProvider" in available:
+            cache_dir = Path(model_path).parent / TRT_ENGINE_CACHE_DIRNAME
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            input_name, height, width = model_input_info(model_path)
+            image_shape = f"{height}x{width}x3"
+            trt_options = {
+                "trt_fp16_enable": True,
+                "trt_engine_cache_enable": True,
+                "trt_engine_cache_path": str(cache_dir),
+                "trt_profile_min_shapes": f"{input_name}:1x{image_shape}",
+                "trt_profile_opt_shapes": f"{input_name}:{BATCH_SIZE}x{image_shape}",
+                "trt_profile_max_shapes": f"{input_name}:{BATCH_SIZE}x{image_shape}",
+            }
+            providers.insert(0, ("TensorrtExecutionProvider", trt_options))
+        return providers
+
+    def load_session(self, model_repo, model_path, sep_tags):
+        providers = self.session_providers(model_path)
+        model = rt.InferenceSession(
+            model_path,
+            sess_options=self.session_options(providers),
+            providers=providers,
+        )
+        print(
+            f"Loaded {model_repo} from {model_path} "
+            f"with providers: {model.get_providers()}"
+        )
+        _, height, width, _ = model.get_inputs()[0].shape
+
+        # Bind a persistent input buffer so ORT doesn't wrap a fresh array per run
+        input_name = model.get_inputs()[0].name
+        output_name = model.get_outputs()[0].name
+        input_buffer = np.zeros((1, height, width, 3), dtype=np.float32)
+        input_ortvalue = rt.OrtValue.ortvalue_from_numpy(input_buffer)
+        io_binding = model.io_binding()
+        io_binding.bind_ortvalue_input(input_name, input_ortvalue)
+        io_binding.bind_output(output_name, "cpu")
+
+        return LoadedModel(
+            model,
+            input_name,
+            output_name,
+            input_buffer,
+            input_ortvalue,
+            io_binding,
+            height,
+            *sep_tags,
+        )
+
     def load_model(self, model_repo):
-        if model_repo == self.last_loaded_repo:
-            return
+        # Only cache access is locked: a slow load (e.g. a first TensorRT
+        # engine build) must not stall requests for models already loaded
+        with self.load_lock:
+            loaded = self.session_cache.pop(model_repo, None)
+            if loaded is not None:
+                # Re-insert to mark it most recently used
+                self.session_cache[model_repo] = loaded
+                return loaded
+            sep_tags = self.label_cache.get(model_repo)
 
         csv_path, model_path = self.download_model(model_repo)
 
-        tags_df = pd.read_csv(csv_path)
-        sep_tags = load_labels(tags_df)
+        # Prefer the INT8 model if quantize.py has been run for this repo
+        if quantized_model_path(model_path).exists():
+            model_path = str(quantized_model_path(model_path))
 
-        self.tag_names = sep_tags[0]
-        self.rating_indexes = sep_tags[1]
-        self.general_indexes = sep_tags[2]
-        self.character_indexes = sep_tags[3]
+        if sep_tags is None:
+            tags_df = pd.read_csv(csv_path)
+            sep_tags = load_labels(tags_df)
 
-        model = rt.InferenceSession(model_path)
-        _, height, width, _ = model.get_inputs()[0].shape
-        self.model_target_size = height
+        loaded = self.load_session(model_repo, model_path, sep_tags)
 
-        self.last_loaded_repo = model_repo
-        self.model = model
+        with self.load_lock:
+            self.label_cache.setdefault(model_repo, sep_tags)
 
-    def prepare_image(self, image):
-        target_size = self.model_target_size
+            # Another request may have loaded the same repo meanwhile; keep
+            # the cached one so every caller shares a single session
+            loaded = self.session_cache.pop(model_repo, loaded)
 
-        canvas = Image.new("RGBA", image.size, (255, 255, 255))
-        canvas.alpha_composite(image)
-        image = canvas.convert("RGB")
+            # Keep only the most recently used sessions; large models are ~1 GB each
+            self.session_cache[model_repo] = loaded
+            while len(self.session_cache) > SESSION_CACHE_SIZE:
+                del self.session_cache[next(iter(self.session_cache))]
 
-        # Pad image to square
-        image_shape = image.size
-        max_dim = max(image_shape)
-        pad_left = (max_dim - image_shape[0]) // 2
-        pad_top = (max_dim - image_shape[1]) // 2
+            return loaded
+
+    def prepare_image(self, image, target_size, out=None):
 
-        padded_image = Image.new("RGB", (max_dim, max_dim), (255, 255, 255))
-        padded_image.paste(image, (pad_left, pad_top))
+        # Flatten transparency onto white, skipping the composite for opaque images
+        if image.mode != "RGB":
+            if image.mode != "RGBA":
+                image = image.convert("RGBA")
+            if image.getchannel("A").getextrema() == (255, 255):
+                image = image.convert("RGB")
+            else:
+                canvas = Image.new("RGBA", image.size, (255, 255, 255))
+                canvas.alpha_composite(image)
+                image = canvas.convert("RGB")
 
-        # Resize
+        # Convert to numpy array
+        image_array = np.asarray(image, dtype=np.uint8)
+
+        # Pad image to square
+        height, width = image_array.shape[:2]
+        max_dim = max(height, width)
+        pad_left = (max_dim - width) // 2
+        pad_top = (max_dim - height) // 2
+
+        image_array = cv2.copyMakeBorder(
+            image_array,
+            pad_top,
+            max_dim - height - pad_top,
+            pad_left,
+            max_dim - width - pad_left,
+            cv2.BORDER_CONSTANT,
+            value=(255, 255, 255),
+        )
+
+        # Resize; INTER_CUBIC doesn't antialias, so use INTER_AREA when shrinking
         if max_dim != target_size:
-            padded_image = padded_image.resize(
+            image_array = cv2.resize(
+                image_array,
                 (target_size, target_size),
-                Image.BICUBIC,
+                interpolation=(
+                    cv2.INTER_AREA if max_dim > target_size else cv2.INTER_CUBIC
+                ),
             )
 
-        # Convert to numpy array
-        image_array = np.asarray(padded_image, dtype=np.float32)
-
-        # Convert PIL-native RGB to BGR
-        image_array = image_array[:, :, ::-1]
+        # Convert PIL-native RGB to BGR, keeping the array C-contiguous
+        image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
 
-        return np.expand_dims(image_array, axis=0)
+        # Write into the caller's (1, H, W, 3) float32 buffer if given;
+        # the uint8 -> float32 cast happens during the copy
+        if out is None:
+            out = np.empty((1, *image_array.shape), dtype=np.float32)
+        np.copyto(out[0], image_array)
+        return out
 
     def predict(
         self,
@@ -179,51 +427,80 @@ class Predictor:
         character_thresh,
         character_mcut_enabled,
     ):
-        self.load_model(model_repo)
-
-        image = self.prepare_image(image)
+        loaded = self.load_model(model_repo)
+
+        # The OrtValue shares memory with input_buffer, so preparing the image
+        # straight into it updates the bound input in place
+        self.prepare_image(image, loaded.target_size, out=loaded.input_buffer)
+        loaded.model.run_with_iobinding(loaded.io_binding)
+        preds = loaded.io_binding.copy_outputs_to_cpu()[0]
+
+        return self.postprocess(
+            loaded,
+            preds[0],
+            general_thresh,
+            general_mcut_enabled,
+            character_thresh,
+            character_mcut_enabled,
+        )
 
-        input_name = self.model.get_inputs()[0].name
-        label_name = self.model.get_outputs()[0].name
-        preds = self.model.run([label_name], {input_name: image})[0]
+    def predict_batch(self, loaded, image_arrays):
+        # Stack the prepared (1, H, W, 3) arrays and run the model once
+        batch = np.concatenate(image_arrays, axis=0)
+        return loaded.model.run([loaded.output_name], {loaded.input_name: batch})[0]
 
-        labels = list(zip(self.tag_names, preds[0].astype(float)))
+    def postprocess(
+        self,
+        loaded,
+        preds,
+        general_thresh,
+        general_mcut_enabled,
+        character_thresh,
+        character_mcut_enabled,
+    ):
+        preds = preds.astype(np.float64)
 
         # First 4 labels are actually ratings: pick one with argmax
-        ratings_names = [labels[i] for i in self.rating_indexes]
-        rating = dict(ratings_names)
+        rating_probs = preds[loaded.rating_indexes]
+        rating = dict(
+            zip(loaded.tag_names[loaded.rating_indexes], rating_probs.tolist())
+        )
 
         # Then we have general tags: pick any where prediction confidence > threshold
-        general_names = [labels[i] for i in self.general_indexes]
+        general_probs = preds[loaded.general_indexes]
 
         if general_mcut_enabled:
-            general_probs = np.array([x[1] for x in general_names])
             general_thresh = mcut_threshold(general_probs)
 
-        general_res = [x for x in general_names if x[1] > general_thresh]
-        general_res = dict(general_res)
+        # Most confident first; stable so ties keep label order
+        general_keep = np.where(general_probs > general_thresh)[0]
+        general_keep = general_keep[
+            np.argsort(-general_probs[general_keep], kind="stable")
+        ]
+        general_res = dict(
+            zip(
+                loaded.tag_names[loaded.general_indexes[general_keep]],
+                general_probs[general_keep].tolist(),
+            )
+        )
 
         # Everything else is characters: pick any where prediction confidence > threshold
-        character_names = [labels[i] for i in self.character_indexes]
+        character_probs = preds[loaded.character_indexes]
 
         if character_mcut_enabled:
-            character_probs = np.array([x[1] for x in character_names])
             character_thresh = mcut_threshold(character_probs)
             character_thresh = max(0.15, character_thresh)
 
-        character_res = [x for x in character_names if x[1] > character_thresh]
-        character_res = dict(character_res)
-
-        sorted_general_strings = sorted(
-            general_res.items(),
-            key=lambda x: x[1],
-            reverse=True,
-        )
-        sorted_general_strings = [x[0] for x in sorted_general_strings]
-        sorted_general_strings = (
-            ", ".join(sorted_general_strings).replace("(", "\\(").replace(")", "\\)")
+        character_keep = np.where(character_probs > character_thresh)[0]
+        character_res = dict(
+            zip(
+                loaded.tag_names[loaded.character_indexes[character_keep]],
+                character_probs[character_keep].tolist(),
+            )
         )
 
+        sorted_general_strings = ", ".join(general_res).translate(PAREN_ESCAPE)
+
         return sorted_general_strings, rating, character_res, general_res
 
 
@@ -237,7 +514,84 @@ def save_caption_to_file(image_path, caption, output_dir):
     with open(output_path, "w", encoding="utf-8") as f:
         f.write(caption)
 
+def prepare_image_file(predictor, target_size, img_path):
+    # Read the whole file up front so decoding works from memory and the
+    # file handle is released immediately, rather than held by PIL's lazy loader
+    try:
+        img = Image.open(BytesIO(Path(img_path).read_bytes()))
+    except UnidentifiedImageError:
+        # Name the file rather than the BytesIO buffer in the error message
+        raise UnidentifiedImageError(
+            f"cannot identify image file {str(img_path)!r}"
+        ) from None
+    return predictor.prepare_image(img, target_size)
+
+def prefetch_images(predictor, target_size, images):
+    # Prepare upcoming images on worker threads while the caller runs
+    # inference; PIL decoding and OpenCV release the GIL. Yields
+    # (img_path, image_array, error_msg) entries in input order.
+    with ThreadPoolExecutor(max_workers=PREFETCH_WORKERS) as executor:
+        image_iter = iter(images)
+        pending = deque()
+
+        def submit_next():
+            img_path = next(image_iter, None)
+            if img_path is not None:
+                future = executor.submit(
+                    prepare_image_file, predictor, target_size, img_path
+                )
+                pending.append((img_path, future))
+
+        for _ in range(PREFETCH_DEPTH):
+            submit_next()
+
+        while pending:
+            img_path, future = pending.popleft()
+            submit_next()
+            try:
+                yield img_path, future.result(), None
+            except Exception as e:
+                yield img_path, None, f"Error processing {Path(img_path).name}: {str(e)}"
+
+def tag_batch(
+    predictor,
+    loaded,
+    batch,
+    general_thresh,
+    general_mcut_enabled,
+    character_thresh,
+    character_mcut_enabled,
+):
+    # batch holds (img_path, image_array, error_msg) entries; entries that
+    # failed to load carry an error message instead of an array
+    image_arrays = [image_array for _, image_array, _ in batch if image_array is not None]
+    try:
+        preds = iter(predictor.predict_batch(loaded, image_arrays) if image_arrays else [])
+    except Exception as e:
+        return [
+            (img_path, None, error_msg or f"Error processing {Path(img_path).name}: {str(e)}")
+            for img_path, _, error_msg in batch
+        ]
+
+    tagged = []
+    for img_path, image_array, error_msg in batch:
+        if image_array is None:
+            tagged.append((img_path, None, error_msg))
+            continue
+
+        sorted_general_strings, _, _, _ = predictor.postprocess(
+            loaded,
+            next(preds),
+            general_thresh,
+            general_mcut_enabled,
+            character_thresh,
+            character_mcut_enabled,
+        )
+        tagged.append((img_path, sorted_general_strings, None))
+    return tagged
+
 def process_batch_images(
+    predictor,
     images,
     model_repo,
     general_thresh,
@@ -247,51 +601,63 @@ def process_batch_images(
     output_dir,
     progress=gr.Progress(track_tqdm=True)
 ):
-    predictor = Predictor()
+    # Use this snapshot for the whole run, even if the other tab switches models
+    loaded = predictor.load_model(model_repo)
     results = []
     total = len(images)
+    batch = []
+    done = 0
+    # Refresh the UI about a hundred times per run rather than for every image
+    yield_every = max(1, total // 100)
     
-    for idx, img_path in enumerate(images, 1):
-        try:
-            img = Image.open(img_path)
-            if img.mode != "RGBA":
-                img = img.convert("RGBA")
-                
-            sorted_general_strings, rating, _, _ = predictor.predict(
-                img,
-                model_repo,
-                general_thresh,
-                general_mcut_enabled,
-                character_thresh,
-                character_mcut_enabled,
-            )
-            
+    for idx, entry in enumerate(prefetch_images(predictor, loaded.target_size, images), 1):
+        batch.append(entry)
+
+        # Keep accumulating until the batch is full or we run out of images
+        if len(batch) < BATCH_SIZE and idx < total:
+            continue
+
+        for img_path, caption, error_msg in tag_batch(
+            predictor,
+            loaded,
+            batch,
+            general_thresh,
+            general_mcut_enabled,
+            character_thresh,
+            character_mcut_enabled,
+        ):
+            done += 1
+
             # Save caption to file if output directory is specified
-            if output_dir:
-                save_caption_to_file(img_path, sorted_general_strings, output_dir)
+            if error_msg is None and output_dir:
+                try:
+                    save_caption_to_file(img_path, caption, output_dir)
+                except Exception as e:
+                    error_msg = f"Error processing {Path(img_path).name}: {str(e)}"
+
+            if error_msg is not None:
+                results.append(error_msg)
+                yield f"Error ({done}/{total})", "\n\n".join(results)
+                continue
             
             # Add just the caption to results
-            results.append(sorted_general_strings)
+            results.append(caption)
             
+            if done % yield_every != 0 and done != total:
+                continue
+
             # Update progress
-            progress_text = f"Processing {Path(img_path).name} ({idx}/{total})"
+            progress_text = f"Processing {Path(img_path).name} ({done}/{total})"
             
             # Yield both progress and results
             yield progress_text, "\n\n".join(results)
-            
-            # Small delay to prevent overwhelming the UI
-            time.sleep(0.1)
-            
-        except Exception as e:
-            error_msg = f"Error processing {Path(img_path).name}: {str(e)}"
-            results.append(error_msg)
-            yield f"Error ({idx}/{total})", "\n\n".join(results)
+        batch = []
     
     return "Done!", "\n\n".join(results)
 
 def main():
     args = parse_args()
-    predictor = Predictor()
+    predictor = Predictor(use_tensorrt=args.tensorrt)
     
     dropdown_list = [
         SWINV2_MODEL_DSV3_REPO,
@@ -455,7 +821,7 @@ def main():
             )
             
             batch_submit.click(
-                process_batch_images,
+                functools.partial(process_batch_images, predictor),
                 inputs=[
                     batch_images,
                     model_repo_batch,
@@ -466,6 +832,8 @@ def main():
                     output_dir,
                 ],
                 outputs=[progress_output, batch_output],
+                # A partial has no __name__; keep the endpoint name it had before
+                api_name="process_batch_images",
             )
 
             gr.Examples(
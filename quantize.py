@@ -0,0 +1,88 @@
+import argparse
+from pathlib import Path
+
+import huggingface_hub
+from onnxruntime.quantization import (
+    CalibrationDataReader,
+    QuantFormat,
+    QuantType,
+    quantize_static,
+)
+from PIL import Image
+
+from app import (
+    HF_TOKEN,
+    MODEL_FILENAME,
+    SWINV2_MODEL_DSV3_REPO,
+    Predictor,
+    model_input_info,
+    quantized_model_path,
+)
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Statically quantize a tagger model to INT8 (QDQ). "
+        "The result is cached next to the downloaded model.onnx and "
+        "picked up automatically by app.py."
+    )
+    parser.add_argument("calibration_dir", type=Path)
+    parser.add_argument("--model-repo", default=SWINV2_MODEL_DSV3_REPO)
+    parser.add_argument("--max-images", type=int, default=100)
+    return parser.parse_args()
+
+
+class ImageCalibrationDataReader(CalibrationDataReader):
+    def __init__(self, predictor, input_name, target_size, image_paths):
+        self.predictor = predictor
+        self.input_name = input_name
+        self.target_size = target_size
+        self.image_iter = iter(image_paths)
+
+    def get_next(self):
+        img_path = next(self.image_iter, None)
+        if img_path is None:
+            return None
+
+        img = Image.open(img_path)
+        return {self.input_name: self.predictor.prepare_image(img, self.target_size)}
+
+
+def main():
+    args = parse_args()
+
+    model_path = huggingface_hub.hf_hub_download(
+        args.model_repo,
+        MODEL_FILENAME,
+        use_auth_token=HF_TOKEN,
+    )
+    output_path = quantized_model_path(model_path)
+
+    # Read the input from the FP32 model itself; Predictor.load_model may pick
+    # an existing INT8 model or build a TensorRT engine first
+    input_name, height, _ = model_input_info(model_path)
+    predictor = Predictor()
+
+    image_paths = sorted(
+        path
+        for path in args.calibration_dir.iterdir()
+        if path.suffix.lower() in IMAGE_EXTENSIONS
+    )[: args.max_images]
+    if not image_paths:
+        raise SystemExit(f"No calibration images found in {args.calibration_dir}")
+
+    quantize_static(
+        model_path,
+        str(output_path),
+        ImageCalibrationDataReader(predictor, input_name, height, image_paths),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QInt8,
+        weight_type=QuantType.QInt8,
+    )
+    print(f"Wrote {output_path} using {len(image_paths)} calibration images")
+
+
+if __name__ == "__main__":
+    main()